@@ -1,3 +1,4 @@
+import heapq
 import math
 import os
 
@@ -5,8 +6,6 @@ import haversine as hs
 import hexutil
 import numpy as np
 
-from collections import Counter
-from .hex import Hex_custom
 from PIL import Image
 
 
@@ -17,7 +16,9 @@ class Map():
     map. The real-life distance from one side of the map to the other
     side is used to calculate the ratio of pixel to meter. Then the
     hexagons are created with doubled coordinates where one hexagon
-    has a width of approximately one meter in real-life.
+    has a width of approximately one meter in real-life. The land
+    covers are stored in an array indexed by the (doubled) coordinates
+    of the hexagons.
 
     Attributes:
     |land_covers: {Int: [RGB, String]}
@@ -30,26 +31,56 @@ class Map():
     |hex_height: Float
     |num_hor: Int
     |num_ver: Int
-    |tiles: {Hex: Int}
     |tree_hexagons: {String: Hex}
 
     Methods:
     |get_tile(Hex): returns the land cover if exists, else defaults
     |   to 5 (no land cover).
+    |get_tile_arr(xs, ys): returns the land covers of the hexagons given
+    |   as arrays of coordinates.
     |get_tree_number(Hex): returns the tree number if the hexagon has a
     | ribbon else returns False.
+    |get_tree_numbers({Hex}): returns the tree numbers of the hexagons
+    |   that have a ribbon.
     |is_passable(Hex): returns true or false depending on if the land
     |   cover associated with the hexagon is passable.
     |cost(Hex): returns the cost of passing through a hexagon based on
     |   its land cover.
+    |find_path(Hex, Hex): returns the cheapest path between two hexagons
+    |   or None if there is none.
+    |field_of_view(Hex, Int): returns the set of hexagons that can be
+    |   seen from the hexagon.
     |is_transparent(Hex): returns whether the hexagon is transparent or not.
     |get_gps_coords(Hex): returns the gps coords of the center of the
     |   hex.
+    |get_gps_coords_batch(xs, ys): returns the gps coords of the centers
+    |   of the hexes as arrays of latitudes and longitudes.
     |load_ribbons(File): loads all the ribbons based on the tree number
     |   and converting its corresponding gps coordinate to a hex location.
+    |fov_tree(Int): helper function to build the shadowcasting tree
+    |   used by field_of_view.
     |rectangle_corners(center, w, h): helper function to calculate the
     |   rectangular dimensions of the pixel area.
+    |most_common_colour(pixel_area): helper function to find the most
+    |   frequent colour of the pixel area.
     """
+    # Cost of passing through each land cover and whether it is passable.
+    # Water and blank are not passable.
+    costs = (None, 1.5, 10, None, 1, None)
+    passable = (False, True, True, False, True, False)
+
+    # Maximum distance between the average colour of a hexagon and the
+    # colour of its land cover before the most common colour is used.
+    max_colour_distance = 50
+
+    # Offsets to the six neighbours of a hexagon in doubled coordinates.
+    _neighbour_offsets = np.array([(2, 0), (1, 1), (-1, 1),
+                                   (-2, 0), (-1, -1), (1, -1)])
+    _neighbour_steps = tuple(map(tuple, _neighbour_offsets.tolist()))
+
+    # Shadowcasting trees used by field_of_view for each maximum distance.
+    _fov_trees = {}
+
     def __init__(self, path):
         """Requires a path to a 24-bit PNG image."""
         self.land_covers = {
@@ -60,6 +91,10 @@ class Map():
             5: [(255, 255, 255), 'blank']
         }
 
+        # Colours of the land covers as an array.
+        self._palette_arr = np.array([v[0] for v in self.land_covers.values()],
+                                     dtype=np.int32)
+
         im = Image.open(path)
         I = np.asarray(im)
 
@@ -90,106 +125,205 @@ class Map():
 
         self.num_hor = num_hor
         self.num_ver = num_ver
-        self.tiles = {}
-
-        # Creates hexagons with a land cover property based on the colour
-        # of the images.
-        for i in range(0, num_hor*num_ver):
-            col = i % num_hor
-            row = i // num_hor
-            even = row % 2
-
-            # Calculates the dimensions of the hexagon in the image.
-            raw = rectangle_corners((col*w + even * w/2, row*h * 3/4), w, h)
-            r = []
-            for points in raw:
-                np0 = int(np.clip(points[0], 0, im.size[0]))
-                np1 = int(np.clip(points[1], 0, im.size[1]))
-                r.append((np0, np1))
-
-            # Calculates the average colour of the pixel area.
-            pixel_area = I[r[0][1]:r[3][1],r[0][0]:r[1][0]]
-            colour = np.average(I[r[0][1]:r[3][1],r[0][0]:r[1][0]], axis=(0,1))
-            colour = tuple(colour.astype(int))
-
-            # Check if the colour corresponds to one of the land covers
-            if not any(colour in val for val in self.land_covers.values()):
-                # Find the most common colour of the pixel area.
-                if len(colour) != 0:
-                    most_freq_colour = Counter(
-                        tuple(x) for x in [j for i in pixel_area for j in i]).most_common(1)[0][0]
-                    colour = most_freq_colour
-
-                # Assign blank if most common colour does not correspond to a land cover.
-                if not any(colour in val for val in self.land_covers.values()):
-                    colour = (255, 255, 255)
-
-            # Creates the land cover with a (doubled) coordinate.
-            land_cover = [k for k, v in self.land_covers.items() if v[0] == colour][0]
-
-            if even == 0:
-                new_hex = Hex_custom(col*2, row)
-                new_hex.add_landcover(land_cover)
-                self.tiles[(col*2, row)] = new_hex
-            else:
-                new_hex = Hex_custom(col * 2 + 1, row)
-                new_hex.add_landcover(land_cover)
-                self.tiles[(col * 2 + 1, row)] = new_hex
+
+        # Differences in gps coordinates between two neighbouring hexagons.
+        self._x_step = (self.top_right_coords[1] - self.top_left_coords[1]) / num_hor
+        self._y_step = (self.top_left_coords[0] - self.bottom_left_coords[0]) / num_ver
+
+        self._width = num_hor * 2
+        self._landcover = np.full((num_ver, self._width), 5, dtype=np.int8)
+
+        # Calculates the dimensions of all hexagons in the image at once.
+        cols = np.arange(num_hor)
+        rows = np.arange(num_ver)
+        even = rows % 2
+        centers_x = cols[None, :]*w + even[:, None] * w/2
+        centers_y = rows*h * 3/4
+        raw = rectangle_corners((centers_x, centers_y), w, h)
+        x0 = np.clip(raw[0][0], 0, im.size[0]).astype(int)
+        x1 = np.clip(raw[1][0], 0, im.size[0]).astype(int)
+        y0 = np.clip(raw[0][1], 0, im.size[1]).astype(int)
+        y1 = np.clip(raw[3][1], 0, im.size[1]).astype(int)
+
+        # Calculates the average colour of every pixel area by summing the
+        # band of pixel rows of each row of hexagons and taking the
+        # differences of the cumulative sums at the hexagon boundaries.
+        colours = np.zeros((num_ver, num_hor, 3), dtype=int)
+        for row in range(num_ver):
+            band = I[y0[row]:y1[row], :, :3].sum(axis=0, dtype=np.int64)
+            cumulative = np.zeros((band.shape[0] + 1, 3), dtype=np.int64)
+            np.cumsum(band, axis=0, out=cumulative[1:])
+
+            area = (x1[row] - x0[row]) * (y1[row] - y0[row])
+            sums = cumulative[x1[row]] - cumulative[x0[row]]
+            # Empty pixel areas are given the colour of a blank land cover.
+            with np.errstate(invalid='ignore'):
+                colour = sums / area[:, None]
+            colours[row] = np.nan_to_num(colour, nan=255).astype(int)
+
+        # Assigns the land cover with the nearest colour to every hexagon.
+        palette = self._palette_arr
+        distances = ((colours[..., None, :] - palette[None, None, :, :]) ** 2).sum(-1)
+        nearest = distances.argmin(-1)
+
+        # Hexagons whose average colour is not near any land cover colour
+        # get the land cover nearest to the most common colour of their
+        # pixel area instead.
+        far = distances.min(-1) > Map.max_colour_distance ** 2
+        for row, col in zip(*np.nonzero(far)):
+            pixel_area = I[y0[row]:y1[row], x0[row, col]:x1[row, col], :3]
+            colour = np.array(most_common_colour(pixel_area))
+            nearest[row, col] = ((palette - colour) ** 2).sum(-1).argmin()
+
+        land_cover_ids = np.array(list(self.land_covers.keys()))
+        land_cover_grid = land_cover_ids[nearest]
+
+        # Stores the land covers at the (doubled) coordinates of the hexagons.
+        self._landcover[rows[:, None], cols*2 + even[:, None]] = land_cover_grid
 
         # Loads corrections to the land covers to draw smaller paths.
         with os.scandir("data/map_corrections") as files:
             for file in files:
-                with open(file) as file:
-                    next(file)
+                coords = np.loadtxt(file.path, delimiter=",", skiprows=1,
+                                    usecols=(0, 1), dtype=int, ndmin=2)
+                self._landcover[coords[:, 1], coords[:, 0]] = 4
 
-                    for line in file:
-                        values = line.split(",")
-                        hex_x = int(values[0])
-                        hex_y = int(values[1])
+        # Whether every hexagon is transparent, hexagons at the top and left
+        # border are not as they have neighbours outside the map.
+        transparent = self._landcover != 5
+        transparent[0, :] = False
+        transparent[:, 0] = False
+        self._transparent_rows = transparent.tolist()
 
-                        hex = self.tiles[(hex_x, hex_y)]
-                        hex.add_landcover(4)
+        # Cost of passing through every hexagon, None if it is not passable.
+        self._cost_rows = np.array(Map.costs, dtype=object)[self._landcover].tolist()
 
         self.tree_hexagons = {}
+        self._hex_to_tree = {}
 
     def get_tile(self, hexagon):
         """Returns the land cover of the hexagon."""
-        custom_hex = self.tiles.get((hexagon.x, hexagon.y))
-        if not custom_hex:
+        x, y = hexagon.x, hexagon.y
+        if not (0 <= x < self._width and 0 <= y < self.num_ver):
             return 5
 
-        return custom_hex.get_landcover()
+        return self._landcover.item(y, x)
+
+    def get_tile_arr(self, xs, ys):
+        """Returns the land covers of multiple hexagons given as arrays of
+        x and y coordinates.
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        tiles = np.full(xs.shape, 5, dtype=np.int8)
+        inside = (xs >= 0) & (xs < self._width) & (ys >= 0) & (ys < self.num_ver)
+        tiles[inside] = self._landcover[ys[inside], xs[inside]]
+
+        return tiles
 
     def get_tree_number(self, hexagon):
         """Returns the tree number of the given hexagon if it has a ribbon."""
-        if hexagon not in self.tree_hexagons.values():
-            return False
+        return self._hex_to_tree.get(hexagon, False)
 
-        tree_hexes = self.tree_hexagons.items()
-        tree_number = [k for k, v in tree_hexes if v == hexagon][0]
+    def get_tree_numbers(self, hexagons):
+        """Returns the tree numbers of the given hexagons that have a
+        ribbon, every tree number only once.
+        """
+        hex_to_tree = self._hex_to_tree
+        tree_numbers = []
+        seen = set()
+        for hexagon in hexagons & hex_to_tree.keys():
+            tree_number = hex_to_tree[hexagon]
+            if tree_number not in seen:
+                seen.add(tree_number)
+                tree_numbers.append(tree_number)
 
-        return tree_number
+        return tree_numbers
 
     def is_passable(self, hexagon):
         """Returns if the hexagon is allowed to be passed through."""
-        land_cover = self.get_tile(hexagon)
-        if land_cover == 3 or land_cover == 5:
-            return False
-
-        return True
+        return Map.passable[self.get_tile(hexagon)]
 
     def cost(self, hexagon):
         """Calculates the cost for each land cover to pass through."""
-        land_cover = self.get_tile(hexagon)
-        # Grass
-        if land_cover == 1:
-            return 1.5
-        # Bushes
-        if land_cover == 2:
-            return 10
-        # Path
-        if land_cover == 4:
-            return 1
+        return Map.costs[self.get_tile(hexagon)]
+
+    def find_path(self, start, destination):
+        """Returns the cheapest path from start to destination as a list
+        of hexagons, or None if there is no path.
+
+        Uses the same A* search as hexutil, but looks up the costs in a
+        precomputed grid instead of calling is_passable and cost for every
+        neighbour.
+        """
+        cost_rows = self._cost_rows
+        width = self._width
+        height = self.num_ver
+        dest_x, dest_y = destination.x, destination.y
+
+        dx = abs(start.x - dest_x)
+        dy = abs(start.y - dest_y)
+        openset = [(dy + max(0, (dx - dy) // 2), 0, start.x, start.y, ())]
+        closedset = set()
+        while openset:
+            _, cost, x, y, path = heapq.heappop(openset)
+            if (x, y) in closedset:
+                continue
+            new_path = ((x, y), path)
+            if x == dest_x and y == dest_y:
+                result = []
+                while new_path:
+                    pos, new_path = new_path
+                    result.append(hexutil.Hex(*pos))
+                result.reverse()
+                return result
+            closedset.add((x, y))
+            for off_x, off_y in Map._neighbour_steps:
+                n_x = x + off_x
+                n_y = y + off_y
+                if not (0 <= n_x < width and 0 <= n_y < height):
+                    continue
+                step = cost_rows[n_y][n_x]
+                if step is None or (n_x, n_y) in closedset:
+                    continue
+                new_cost = cost + step
+                dx = abs(n_x - dest_x)
+                dy = abs(n_y - dest_y)
+                heapq.heappush(openset, (new_cost + dy + max(0, (dx - dy) // 2),
+                                         new_cost, n_x, n_y, new_path))
+
+        return None
+
+    def field_of_view(self, hexagon, max_distance):
+        """Returns the set of hexagons that can be seen from the hexagon.
+
+        Uses the same shadowcasting as hexutil, but walks a precomputed
+        tree of offsets and looks up the transparency of the hexagons in
+        a grid instead of calling is_transparent.
+        """
+        nodes = Map._fov_trees.get(max_distance)
+        if nodes is None:
+            nodes = Map._fov_trees[max_distance] = fov_tree(max_distance)
+
+        transparent_rows = self._transparent_rows
+        width = self._width
+        height = self.num_ver
+        x, y = hexagon.x, hexagon.y
+
+        visible = {(x, y)}
+        for direction in range(6):
+            stack = [0] if nodes else []
+            while stack:
+                offsets, children = nodes[stack.pop()]
+                off_x, off_y = offsets[direction]
+                n_x = x + off_x
+                n_y = y + off_y
+                visible.add((n_x, n_y))
+                if (0 <= n_x < width and 0 <= n_y < height
+                    and transparent_rows[n_y][n_x]):
+                    stack.extend(children)
+
+        return {hexutil.Hex(*pos) for pos in visible}
 
     def is_transparent(self, hexagon):
         """Returns whether the hexagon is transparent or not."""
@@ -200,76 +334,88 @@ class Map():
         if (hexagon.x == 0 or hexagon.y == 0
             or hexagon.x == self.num_hor * 2
             or hexagon.y == self.num_ver):
-            neighbours = hexagon.neighbours()
-            for neighbour in neighbours:
-                if self.get_tile(neighbour) == 5:
-                    return False
+            xs = hexagon.x + Map._neighbour_offsets[:, 0]
+            ys = hexagon.y + Map._neighbour_offsets[:, 1]
+            height, width = self._landcover.shape
+            if (xs.min() < 0 or ys.min() < 0
+                or xs.max() >= width or ys.max() >= height):
+                return False
+
+            if np.any(self._landcover[ys, xs] == 5):
+                return False
 
         return True
 
     def get_gps_coords(self, hex):
         """Returns the real coordinates of the center of a hexagon."""
-        # x coordinate
-        x_difference = self.top_right_coords[1] - self.top_left_coords[1]
-        x_difference_hex = x_difference / self.num_hor
-        x = self.top_left_coords[1] + hex.x / 2 * x_difference_hex
-
-        # y coordinate
-        y_difference = self.top_left_coords[0] - self.bottom_left_coords[0]
-        y_difference_hex = y_difference / self.num_ver
-        y = self.top_left_coords[0] - hex.y * y_difference_hex
+        x = self.top_left_coords[1] + hex.x / 2 * self._x_step
+        y = self.top_left_coords[0] - hex.y * self._y_step
 
         return (y, x)
 
+    def get_gps_coords_batch(self, xs, ys):
+        """Returns the real coordinates of the centers of multiple hexagons
+        given as arrays of x and y coordinates.
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        lats = self.top_left_coords[0] - ys * self._y_step
+        longs = self.top_left_coords[1] + xs / 2 * self._x_step
+
+        return lats, longs
+
     def load_ribbons(self, file_path):
         """Loads all the ribbons from the specified file into the model on
         the basis of their gps coordinates.
         """
         self.tree_hexagons.clear()
+        self._hex_to_tree.clear()
         with open(file_path) as file:
             next(file)
-
-            # put each hexagon with a ribbon in it into a dictionary
-            for line in file:
-                # get the gps coordinates of a ribbon
-                values = line.split(",")
-                y_gps, x_gps = float(values[0]), float(values[1])
-
-                # determine y coordinate of the corresponding hexagon in model
-                loc1 = self.top_left_coords
-                loc2 = (y_gps, self.top_left_coords[1])
-                dist_from_top = hs.haversine(loc1, loc2) * 1000
-                y_model = int(round(dist_from_top / (self.hex_height * 3/4)))
-
-                # determine x coordinate of the corresponding hexagon in model
-                loc2 = (self.top_left_coords[0], x_gps)
-                dist_from_left = hs.haversine(loc1, loc2) * 1000
-
-                if y_model % 2 == 0:
-                    x_model = int(round(dist_from_left/self.hex_width)) * 2
-                else:
-                    x_model = int(round((dist_from_left + self.hex_width / 2) /
-                                    self.hex_width)) * 2 + 1
-
-                # get hex object form dictionary
-                hex = self.tiles.get((x_model, y_model))
-
-                # make sure the ribbon is placed in the right hex, because the x
-                # and y of the model are determined with squares instead of hexes
-                hex_coords = self.get_gps_coords(hex)
-                distance_to_center = hs.haversine((y_gps, x_gps), hex_coords)
+            rows = [line.split(",") for line in file]
+
+        # get the gps coordinates of all ribbons
+        ribbons = np.array([(float(values[0]), float(values[1]))
+                            for values in rows]).reshape(-1, 2)
+
+        # determine the coordinates of the hexagons of all ribbons at once by
+        # inverting get_gps_coords
+        y_models = np.rint((self.top_left_coords[0] - ribbons[:, 0])
+                           / self._y_step).astype(int)
+        x_halves = (ribbons[:, 1] - self.top_left_coords[1]) / self._x_step
+        parities = y_models % 2
+        x_models = np.rint(x_halves - parities / 2).astype(int) * 2 + parities
+
+        # put each hexagon with a ribbon in it into a dictionary
+        for values, ribbon, x_model, y_model in zip(rows, ribbons,
+                                                     x_models, y_models):
+            hex = hexutil.Hex(int(x_model), int(y_model))
+
+            # make sure the ribbon is placed in the right hex, because the
+            # steps in latitude and longitude are not equally long, by moving
+            # it to the closest neighbour until no neighbour is closer
+            distance_to_center = hs.haversine(ribbon, self.get_gps_coords(hex))
+            while True:
                 neighbours = hex.neighbours()
+                lats, longs = self.get_gps_coords_batch(
+                    [neighbour.x for neighbour in neighbours],
+                    [neighbour.y for neighbour in neighbours])
+                distances = hs.haversine_vector(
+                    np.broadcast_to(ribbon, (len(neighbours), 2)),
+                    np.column_stack((lats, longs)))
+                closest = int(np.argmin(distances))
+                if distances[closest] >= distance_to_center:
+                    break
+
+                hex = neighbours[closest]
+                distance_to_center = distances[closest]
 
-                for neighbour in neighbours:
-                    neighbour_coords = self.get_gps_coords(neighbour)
-                    distance_to_neighbour = hs.haversine((y_gps, x_gps),
-                                                    (neighbour.x, y_model))
-                    if distance_to_center > distance_to_neighbour:
-                        hex = neighbour
-                        break
+            # put hexagon in dictionary
+            self.tree_hexagons[values[2]] = hex
 
-                # put hexagon in dictionary
-                self.tree_hexagons[values[2]] = hex
+        # map each hexagon with a ribbon to the first tree number in it
+        for tree_number, hex in self.tree_hexagons.items():
+            self._hex_to_tree.setdefault(hex, tree_number)
 
 
 def rectangle_corners(center, w, h):
@@ -283,3 +429,61 @@ def rectangle_corners(center, w, h):
         (x +w/2, y + h/2),
         (x -w /2, y + h/2)
     ]
+
+
+def most_common_colour(pixel_area):
+    """Helper function to find the most frequent colour of a pixel area.
+
+    Ties are broken by the colour that occurs first in the pixel area.
+    Returns the colour of a blank land cover if the area is empty.
+    """
+    if pixel_area.size == 0:
+        return (255, 255, 255)
+
+    values, first, counts = np.unique(pixel_area.reshape(-1, 3), axis=0,
+                                      return_index=True, return_counts=True)
+    first[counts != counts.max()] = pixel_area.size
+
+    return tuple(int(v) for v in values[first.argmin()])
+
+
+def fov_tree(max_distance):
+    """Helper function to build the shadowcasting tree of hexutil's
+    field_of_view up to the maximum distance.
+
+    Returns a list of nodes of the form (offsets, children), where
+    offsets are the positions of the node relative to the viewer in
+    each of the six directions and children are the indices of the
+    nodes that are visited when the node is transparent. The first
+    node is the root.
+    """
+    corners = ((0, -2), (1, -1), (1, 1), (0, 2))
+    neighbours = (hexutil.Hex(1, -1), hexutil.Hex(2, 0), hexutil.Hex(1, 1))
+    origin = hexutil.Hex(0, 0)
+
+    nodes = []
+
+    def add_node(hexagon, angle1, angle2):
+        if hexagon.distance(origin) > max_distance:
+            return None
+
+        index = len(nodes)
+        offsets = tuple(tuple(rotate(hexagon)) for rotate in hexutil.Hex.rotations)
+        nodes.append(None)
+
+        x, y = hexagon
+        angles = [(3*y + cy) / float(x + cx) for cx, cy in corners]
+        children = []
+        for i in range(3):
+            c1 = max(angle1, angles[i])
+            c2 = min(angle2, angles[i + 1])
+            if c1 < c2:
+                child = add_node(hexagon + neighbours[i], c1, c2)
+                if child is not None:
+                    children.append(child)
+
+        nodes[index] = (offsets, tuple(children))
+        return index
+
+    add_node(hexutil.Hex(2, 0), -1.0, 1.0)
+    return nodes
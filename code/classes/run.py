@@ -1,3 +1,11 @@
+from collections import deque
+
+
+# Differences in doubled coordinates between a hexagon and its neighbours.
+_NEIGHBOUR_OFFSETS = frozenset([(2, 0), (1, 1), (-1, 1),
+                                (-2, 0), (-1, -1), (1, -1)])
+
+
 class Run():
     """Represents an elapsed route, a run, by storing hexagons in order.
 
@@ -7,7 +15,7 @@ class Run():
     Attributes:
     |run_id: Int
     |name: String
-    |hexagons: [Hex]
+    |hexagons: deque(Hex)
 
     Methods:
     |add_hexagon(Hex): only adds a hexagon to the begining or end
@@ -19,21 +27,21 @@ class Run():
         """Requires a unique ID."""
         self.run_id = uid
         self.name = ""
-        self.hexagons = []
+        self.hexagons = deque()
 
     def add_hexagon(self, hexagon):
         """Only adds a hexagon to the beginning or end of the run."""
         if len(self.hexagons) > 0:
             # Adds to end if neighbouring last hex.
             last_hex = self.hexagons[-1]
-            if hexagon in last_hex.neighbours():
+            if are_neighbours(hexagon, last_hex):
                 self.hexagons.append(hexagon)
                 return True
 
             # Adds to beginning if neighbouring first hex.
             first_hex = self.hexagons[0]
-            if hexagon in first_hex.neighbours():
-                self.hexagons.insert(0, hexagon)
+            if are_neighbours(hexagon, first_hex):
+                self.hexagons.appendleft(hexagon)
                 return True
         else:
             self.hexagons.append(hexagon)
@@ -45,11 +53,11 @@ class Run():
         """Removes the first or last hexagon of the run."""
         if len(self.hexagons) > 1:
             if hexagon == self.hexagons[-1]:
-                del self.hexagons[-1]
+                self.hexagons.pop()
                 return True
 
             if hexagon == self.hexagons[0]:
-                del self.hexagons[0]
+                self.hexagons.popleft()
                 return True
 
         return False
@@ -57,3 +65,8 @@ class Run():
     def get_hexagons(self):
         """Returns all the hexagons of the run."""
         return self.hexagons
+
+
+def are_neighbours(hexagon, other):
+    """Helper function to check if two hexagons are next to each other."""
+    return (hexagon.x - other.x, hexagon.y - other.y) in _NEIGHBOUR_OFFSETS
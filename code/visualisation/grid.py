@@ -1,10 +1,16 @@
 import hexutil
+import numpy as np
 
 from ..classes.map import Map
 from ..classes.run import Run
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 
+# Corners of a hexagon relative to its center in units of the width and
+# height of the hexgrid, in the same order as hexutil.HexGrid.corners.
+_CORNER_OFFSETS = np.array([(1, 1), (0, 2), (-1, 1), (-1, -1), (0, -2), (1, -1)])
+
+
 class Grid(QtWidgets.QWidget):
     """Represents the visual hexagonal grid.
 
@@ -30,9 +36,9 @@ class Grid(QtWidgets.QWidget):
     |run_creation_mode: Bool
     |current_run_id: Int
     |optimal_runs: {Int: Run}
-    |path: []
+    |path: (Hex)
     |toggle_fov: Bool
-    |fov: {Hex: Int}
+    |fov: {Hex}
 
     Methods:
     |load_run(run_label): loads the run with the id that is in the given
@@ -49,16 +55,27 @@ class Grid(QtWidgets.QWidget):
     |   given hexagon and returns the tree numbers that are seen in the fov.
     |mousePressEvent(event): handles mouse presses to select and
     |   deselect hexagons with different functionalities.
+    |set_path([Hex]): sets the optimal path to the given hexagons.
     |update_size(): resizes the widget according to the pixel location
     |   of the hexagon in the bottom right corner.
     |hexagon_at_center(): returns the hexagon at the middle of the window.
     |hexagon_of_pos(pos): returns the hex that belongs to the given
     |   screen coordinate.
     |mousePressEvent(event): handles mouse presses to select hexagons.
+    |load_ribbons(file_path): loads the ribbons of the file into the map.
     |adjust_res(factor): changes the resolution of the hexagons
     |   so that they become larger or smaller.
     |adjust_window(x, y, width, height): changes the boundaries of
     |   the window.
+    |outlines(): returns the outlined hexagons with their kind of outline.
+    |update_outlines({(String, Hex)}): repaints the hexagons of which
+    |   the outline has changed.
+    |update_hexagons([Hex]): repaints the area that covers the hexagons.
+    |land_cover_polygons(Rectangle): returns the polygons of the hexagons
+    |   in the rectangle per land cover.
+    |render_background(Rectangle): returns a pixmap of the land covers of
+    |   the hexagons in the rectangle.
+    |polygon(Hex): returns the (cached) polygon of the hexagon.
     |paintEvent(event): draws the hexagons that fit in the window with
     |   a colour based on their land cover.
     """
@@ -84,6 +101,22 @@ class Grid(QtWidgets.QWidget):
         # Initialises GUI objects needed for painting.
         self.pen = QtGui.QPen()
         self.pen.setWidth(2)
+        self._brushes = {tile: QtGui.QBrush(QtGui.QColor(*colour))
+                         for tile, (colour, _) in self.map.land_covers.items()}
+        self._tree_pen = QtGui.QPen(QtGui.QColor('red'), 4)
+        self._selected_pen = QtGui.QPen(QtGui.QColor('white'), 2)
+        self._path_pen = QtGui.QPen(QtGui.QColor('magenta'), 2)
+        self._run_pen = QtGui.QPen(QtGui.QColor('red'), 2)
+        self._fov_pen = QtGui.QPen(QtGui.QColor('yellow'), 2)
+
+        # Caches the polygons of the hexagons and a pixmap of the land
+        # covers of the visible hexagons.
+        self._poly_cache = {}
+        self._background = None
+        self.background_rect = QtCore.QRect()
+
+        # Caches the centers of the hexagons that contain a ribbon.
+        self._tree_dots = None
 
         # Initialises the window size boundaries of the grid.
         self.maximum_size = []
@@ -101,15 +134,17 @@ class Grid(QtWidgets.QWidget):
 
         # Initialises functionality for optimal runs.
         self.optimal_runs = {}
-        self.path = []
+        self.path = ()
+        self._path_last = None
 
         # Initialises fov functionality.
         self.toggle_fov = False
-        self.fov = []
+        self.fov = set()
 
     def load_run(self, run_label):
         """Loads the run provided by the label of the GUI run list."""
-        run_id = int(run_label.text().partition(':')[0])
+        run_id = run_label.data(QtCore.Qt.UserRole)
+        old_outlines = self.outlines()
         self.current_run_id = run_id
 
         # Activates the 'run creation mode' where the user can add
@@ -117,7 +152,7 @@ class Grid(QtWidgets.QWidget):
         self.run_creation_mode = True
         self.run_creation.emit(True)
 
-        self.repaint()
+        self.update_outlines(old_outlines)
 
     def create_run(self, name="", hexagons=0):
         """Creates a run with the selected hex or loaded hexagons."""
@@ -139,6 +174,7 @@ class Grid(QtWidgets.QWidget):
 
             self.run_uid += 1
         else:
+            old_outlines = self.outlines()
             new_run.add_hexagon(self.selected_hexagon)
             self.runs[self.run_uid] = new_run
 
@@ -150,17 +186,19 @@ class Grid(QtWidgets.QWidget):
             self.run_creation.emit(True)
             self.run_creation_mode = True
 
-            self.repaint()
+            self.update_outlines(old_outlines)
 
     def modify_current_run(self, hexagon):
         """Adds or removes the hex from the current run if allowed."""
         current_run = self.runs[self.current_run_id]
         if (current_run.add_hexagon(hexagon)
            or current_run.remove_hexagon(hexagon)):
-            self.repaint()
+            self.update_hexagons([hexagon])
 
     def save_current_run(self, name):
         """Saves the current run to the current session."""
+        old_outlines = self.outlines()
+
         # Disables the run creation mode and its GUI elements.
         self.run_creation_mode = False
         self.run_creation.emit(False)
@@ -179,12 +217,14 @@ class Grid(QtWidgets.QWidget):
         self.selected.emit(self.selected_hexagon)
 
         # Clears the optimal path.
-        self.path = 0
+        self.set_path(())
 
-        self.repaint()
+        self.update_outlines(old_outlines)
 
     def delete_current_run(self):
         """Deletes the current run from the current session."""
+        old_outlines = self.outlines()
+
         # Disables the run creation mode and its GUI elements.
         self.run_creation_mode = False
         self.run_creation.emit(False)
@@ -202,9 +242,9 @@ class Grid(QtWidgets.QWidget):
         self.optimal_runs.pop(self.current_run_id, None)
 
         # Clears the optimal path.
-        self.path = 0
+        self.set_path(())
 
-        self.repaint()
+        self.update_outlines(old_outlines)
 
     def create_optimal_run(self, run_id):
         """Creates a run with optimal distances between ribbons
@@ -213,10 +253,13 @@ class Grid(QtWidgets.QWidget):
         run = self.runs[run_id]
 
         # Collects the numbers of every tree visited in the run.
+        # The set is used for membership and the list keeps the order.
         visited_trees = []
+        seen = set()
         for hexagon in run.get_hexagons():
             tree_number = self.map.get_tree_number(hexagon)
-            if tree_number and tree_number not in visited_trees:
+            if tree_number and tree_number not in seen:
+                seen.add(tree_number)
                 visited_trees.append(tree_number)
 
         optimal_run = Run(run_id)
@@ -228,14 +271,11 @@ class Grid(QtWidgets.QWidget):
         # the first ribbon, and then every ribbon after.
         for tree_number in visited_trees:
             tree_hexagon = self.map.tree_hexagons[tree_number]
-            path = current_position.find_path(tree_hexagon,
-                                              self.map.is_passable,
-                                              self.map.cost)
+            path = self.map.find_path(current_position, tree_hexagon)
 
             # Adds every hexagon besides the first one to the optimal run.
             for hexagon in path[1:]:
-                custom_hex = self.map.tiles[(hexagon.x, hexagon.y)]
-                optimal_run.add_hexagon(custom_hex)
+                optimal_run.add_hexagon(hexagon)
 
             # Sets the tree as the starting position for the next path.
             current_position = tree_hexagon
@@ -246,24 +286,15 @@ class Grid(QtWidgets.QWidget):
         """Sets the current fov to all tiles seen by the given hexagon
         and returns the tree numbers that are seen in the fov.
         """
-        self.fov.clear()
-        self.fov = hexagon.field_of_view(self.map.is_transparent, max_distance=10)
-        # Checks if a tree is seen from the given hexagon.
-        seen_trees = []
-        for hex in self.fov:
-            custom_hex = self.map.tiles.get((hex.x, hex.y))
-            if not custom_hex:
-                continue
-            else:
-                tree_number = self.map.get_tree_number(custom_hex)
-                # Only adds tree number if not seen before.
-                if tree_number:
-                    seen_trees.append(tree_number)
+        old_fov = self.fov
+        self.fov = self.map.field_of_view(hexagon, max_distance=10)
+        if self.toggle_fov:
+            self.update_hexagons(old_fov ^ self.fov)
+        # Checks which trees are seen from the given hexagon.
+        seen_trees = self.map.get_tree_numbers(self.fov)
 
         return seen_trees
 
-        self.repaint()
-
     def mousePressEvent(self, event):
         """Handles mouse presses to select and deselect hexagons.
 
@@ -278,19 +309,19 @@ class Grid(QtWidgets.QWidget):
         """
         clicked_hexagon = self.hexagon_of_pos(event.pos())
         hex = self.map.get_tile(clicked_hexagon)
+        old_outlines = self.outlines()
 
         # Left click is selection, right click is selecting optimal path.
         if event.button() == 1:
-            if self.path and clicked_hexagon == self.path[-1]:
+            if self._path_last is not None and clicked_hexagon == self._path_last:
                 # Adds the hexagons of the optimal path to the run.
                 for hexagon in self.path:
-                    custom_hex = self.map.tiles[(hexagon.x, hexagon.y)]
-                    self.modify_current_run(custom_hex)
-                self.path = []
+                    self.modify_current_run(hexagon)
+                self.set_path(())
                 self.selected_hexagon = 0
             elif self.selected_hexagon != clicked_hexagon and hex != 5:
                 # Selects the hexagon that has been clicked.
-                self.selected_hexagon = self.map.tiles[clicked_hexagon.x, clicked_hexagon.y]
+                self.selected_hexagon = clicked_hexagon
                 if self.toggle_fov:
                     self.update_fov(self.selected_hexagon)
             else:
@@ -301,18 +332,22 @@ class Grid(QtWidgets.QWidget):
         elif event.button() == 2:
             if self.run_creation_mode:
                 # Removes the current optimal path or creates one.
-                if self.path and self.path[-1] == clicked_hexagon:
-                    self.path = []
+                if self._path_last is not None and self._path_last == clicked_hexagon:
+                    self.set_path(())
                 else:
                     current_run = self.runs[self.current_run_id]
                     hex = current_run.get_hexagons()[-1]
-                    self.path = hex.find_path(clicked_hexagon,
-                                            self.map.is_passable,
-                                            self.map.cost)
+                    path = self.map.find_path(hex, clicked_hexagon)
 
-                    self.path.pop(0)
+                    # Leaves out the last hexagon of the run.
+                    self.set_path(path[1:] if path else ())
 
-        self.repaint()
+        self.update_outlines(old_outlines)
+
+    def set_path(self, hexagons):
+        """Sets the optimal path to the given hexagons."""
+        self.path = tuple(hexagons)
+        self._path_last = self.path[-1] if self.path else None
 
     def update_size(self):
         """Resizes according to the hex in the bottom right corner."""
@@ -323,6 +358,7 @@ class Grid(QtWidgets.QWidget):
 
         self.resize(bottom_right_pixel[0], bottom_right_pixel[1])
         self.maximum_size = [bottom_right_pixel[0], bottom_right_pixel[1]]
+        self._background = None
 
     def hexagon_at_center(self):
         """Returns the hexagon at the middle of the window."""
@@ -335,6 +371,12 @@ class Grid(QtWidgets.QWidget):
         """Computes the hexagon at the given screen position."""
         return self.hexgrid.hex_at_coordinate(pos.x(), pos.y())
 
+    def load_ribbons(self, file_path):
+        """Loads the ribbons of the file into the map and shows them."""
+        self.map.load_ribbons(file_path)
+        self._tree_dots = None
+        self.repaint()
+
     def adjust_res(self, factor):
         """Adjusts the visual pixel size of the hexagons if possible."""
         old_res = self.res
@@ -348,6 +390,9 @@ class Grid(QtWidgets.QWidget):
             return False
 
         self.hexgrid = hexutil.HexGrid(self.res)
+        self._background = None
+        self._poly_cache.clear()
+        self._tree_dots = None
 
         return True
 
@@ -359,6 +404,104 @@ class Grid(QtWidgets.QWidget):
         """
         self.window = hexutil.Rectangle(x, y, width, height)
 
+    def outlines(self):
+        """Returns the outlined hexagons paired with their kind of outline.
+
+        The fov is not included, update_fov repaints it itself.
+        """
+        outlines = set()
+        if self.selected_hexagon:
+            outlines.add(('selected', self.selected_hexagon))
+        if self.path:
+            outlines.update(('path', hexagon) for hexagon in self.path)
+        if self.run_creation_mode:
+            current_run = self.runs[self.current_run_id]
+            outlines.update(('run', hexagon)
+                            for hexagon in current_run.get_hexagons())
+
+        return outlines
+
+    def update_outlines(self, old_outlines):
+        """Repaints the hexagons of which the outline has changed."""
+        changed = old_outlines ^ self.outlines()
+        self.update_hexagons([hexagon for _, hexagon in changed])
+
+    def update_hexagons(self, hexagons):
+        """Schedules a repaint of only the area that covers the hexagons."""
+        if not hexagons:
+            return
+
+        # Takes the bounding boxes of the outermost hexagons and leaves room
+        # for the width of the outlines and the ribbon dots.
+        width, height = self.hexgrid
+        xs = [h.x for h in hexagons]
+        ys = [h.y for h in hexagons]
+        x0 = width * (min(xs) - 1) - 2
+        y0 = height * (3 * min(ys) - 2) - 2
+        x1 = width * (max(xs) + 1) + 2
+        y1 = height * (3 * max(ys) + 2) + 2
+        self.update(QtCore.QRect(x0, y0, x1 - x0, y1 - y0))
+
+    def land_cover_polygons(self, bbox):
+        """Returns the polygons of the hexagons that fit in the bounding
+        box per land cover, blank hexagons are left out.
+        """
+        xs, ys = hexes_in_rectangle(self.hexgrid, bbox)
+        tiles = self.map.get_tile_arr(xs, ys)
+        polygons = {}
+        for tile in self.map.land_covers:
+            if tile != 5:
+                in_tile = tiles == tile
+                corners = corners_batch(self.hexgrid, xs[in_tile], ys[in_tile])
+                polygons[tile] = [QtGui.QPolygon(points) for points
+                                  in corners.reshape(-1, 12).tolist()]
+
+        return polygons
+
+    def render_background(self, bbox):
+        """Returns a pixmap of the bounding box with every hexagon that
+        fits in it drawn with the colour of its land cover.
+
+        The pixmap has a margin around the bounding box for the hexagons
+        that stick out of it, its area is stored in background_rect.
+        """
+        margin = 3 * self.res
+        self.background_rect = QtCore.QRect(*bbox).adjusted(-margin, -margin,
+                                                            margin, margin)
+        ratio = self.devicePixelRatioF()
+        background = QtGui.QPixmap(int(self.background_rect.width() * ratio),
+                                   int(self.background_rect.height() * ratio))
+        background.setDevicePixelRatio(ratio)
+        background.fill(QtCore.Qt.transparent)
+
+        painter = QtGui.QPainter()
+        painter.begin(background)
+        try:
+            painter.setPen(self.pen)
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            painter.translate(-self.background_rect.topLeft())
+
+            # Sets the brush only once per land cover.
+            for tile, polygons in self.land_cover_polygons(bbox).items():
+                painter.setBrush(self._brushes[tile])
+                for polygon in polygons:
+                    painter.drawPolygon(polygon)
+        finally:
+            painter.end()
+
+        return background
+
+    def polygon(self, hexagon):
+        """Returns the polygon of the hexagon at the current res."""
+        key = (hexagon.x, hexagon.y)
+        polygon = self._poly_cache.get(key)
+        if polygon is None:
+            polygon = QtGui.QPolygon([QtCore.QPoint(*corner)
+                                      for corner in self.hexgrid.corners(hexagon)])
+            self._poly_cache[key] = polygon
+
+        return polygon
+
     def paintEvent(self, event):
         """Draws the hexagons that fit in the window.
 
@@ -369,8 +512,9 @@ class Grid(QtWidgets.QWidget):
         the current run are given a special outline colour.
         """
         bbox = self.window
-        self.hexgrid = hexutil.HexGrid(self.res)
         hexgrid = self.hexgrid
+        grid_map = self.map
+        polygon_of = self.polygon
 
         painter = QtGui.QPainter()
         painter.begin(self)
@@ -381,58 +525,101 @@ class Grid(QtWidgets.QWidget):
             painter.setRenderHint(QtGui.QPainter.TextAntialiasing)
             painter.translate(0, 0)
 
-            # Draws all the hexagons that fit in the window (bounding box).
-            for hexagon in hexgrid.hexes_in_rectangle(bbox):
-                polygon = QtGui.QPolygon(
-                    [QtCore.QPoint(*corner) for corner in hexgrid.corners(hexagon)])
-
-                tile = self.map.get_tile(hexagon)
-                if tile != 5:
-                    colour = self.map.land_covers[tile][0]
-                    painter.setBrush(QtGui.QBrush(QtGui.QColor(colour[0],
-                                                               colour[1],
-                                                               colour[2])))
-                    painter.drawPolygon(polygon)
+            # Draws the hexagons in the part of the window (bounding box)
+            # that has to be repainted from the background. The background
+            # covers an area around the window as well, so it is only drawn
+            # again when the res changes or the window is scrolled out of it.
+            margin = 3 * self.res
+            rect = event.rect().intersected(
+                QtCore.QRect(*bbox).adjusted(-margin, -margin, margin, margin))
+            if (self._background is None
+                or not self.background_rect.contains(rect)):
+                self._background = self.render_background(hexutil.Rectangle(
+                    bbox.x - bbox.width // 2, bbox.y - bbox.height // 2,
+                    2 * bbox.width, 2 * bbox.height))
+            rect = QtCore.QRectF(rect)
+            ratio = self._background.devicePixelRatio()
+            source = rect.translated(-QtCore.QPointF(self.background_rect.topLeft()))
+            source = QtCore.QRectF(source.topLeft() * ratio, source.size() * ratio)
+            painter.drawPixmap(rect, self._background, source)
 
             # Draws a dot in every hexagon that contains a ribbon.
-            if self.map.tree_hexagons:
-                for tree_number in self.map.tree_hexagons:
-                    hexagon = self.map.tree_hexagons[tree_number]
-                    location = hexgrid.center(hexagon)
-                    painter.setPen(QtGui.QPen(QtGui.QColor('red'), 4))
-                    painter.drawPoint(location[0], location[1])
+            if grid_map.tree_hexagons:
+                if self._tree_dots is None:
+                    self._tree_dots = tree_dots(hexgrid,
+                                                grid_map.tree_hexagons.values())
+                painter.setPen(self._tree_pen)
+                painter.drawPoints(self._tree_dots)
+
+            # Outlines are drawn without filling the hexagons.
+            painter.setBrush(QtCore.Qt.NoBrush)
+            draw_polygon = painter.drawPolygon
 
             # Draws the outline of the selected hexagon.
             if self.selected_hexagon:
-                corners = [QtCore.QPoint(*corner) for corner in hexgrid.corners(self.selected_hexagon)]
-                painter.setPen(QtGui.QPen(QtGui.QColor('white'), 2))
-                for i, corner in enumerate(corners):
-                    painter.drawLine(corners[-1 + i], corner)
+                painter.setPen(self._selected_pen)
+                draw_polygon(polygon_of(self.selected_hexagon))
 
             # Fraws the outlines of the hexagons of the optimal path.
             if self.path:
+                painter.setPen(self._path_pen)
                 for hex in self.path:
-                    corners = [QtCore.QPoint(*corner) for corner in hexgrid.corners(hex)]
-                    painter.setPen(QtGui.QPen(QtGui.QColor('magenta'), 2))
-                    for i, corner in enumerate(corners):
-                        painter.drawLine(corners[-1 + i], corner)
+                    draw_polygon(polygon_of(hex))
 
             # Draws the outlines of the hexagons of the current run in creation.
             if self.run_creation_mode:
                 current_run = self.runs[self.current_run_id]
-                for coords in current_run.get_hexagons():
-                    hexagon = self.map.tiles[coords]
-                    corners = [QtCore.QPoint(*corner) for corner in hexgrid.corners(hexagon)]
-                    painter.setPen(QtGui.QPen(QtGui.QColor('red'), 2))
-                    for i, corner in enumerate(corners):
-                        painter.drawLine(corners[-1 + i], corner)
+                painter.setPen(self._run_pen)
+                for hexagon in current_run.get_hexagons():
+                    draw_polygon(polygon_of(hexagon))
 
             # Draws the outline of the fov if toggled on.
             if self.fov and self.toggle_fov:
+                painter.setPen(self._fov_pen)
                 for hex in self.fov:
-                    corners = [QtCore.QPoint(*corner) for corner in hexgrid.corners(hex)]
-                    painter.setPen(QtGui.QPen(QtGui.QColor('yellow'), 2))
-                    for i, corner in enumerate(corners):
-                        painter.drawLine(corners[-1 + i], corner)
+                    draw_polygon(polygon_of(hex))
         finally:
             painter.end()
+
+
+def hexes_in_rectangle(hexgrid, rectangle):
+    """Helper function to calculate the coordinates of the hexagons in
+    the rectangle like hexutil's hexes_in_rectangle.
+
+    Returns two arrays with the x and y coordinates of the hexagons,
+    ordered by row.
+    """
+    rx, ry, r_width, r_height = rectangle
+    width, height = hexgrid
+    x_lo = (rx - 1) // width
+    x_hi = (rx + r_width + 2*width - 1) // width
+    y_lo = (ry + height - 1) // (3*height)
+    y_hi = (ry + r_height + 5*height - 1) // (3*height)
+    ys, xs = np.mgrid[y_lo:y_hi, x_lo:x_hi]
+    even = (xs + ys) % 2 == 0
+
+    return xs[even], ys[even]
+
+
+def corners_batch(hexgrid, xs, ys):
+    """Helper function to calculate the corners of multiple hexagons.
+
+    Returns an array of shape (N, 6, 2) with the pixel coordinates of
+    the corners of every hexagon.
+    """
+    corners = np.empty((len(xs), 6, 2), dtype=int)
+    corners[..., 0] = hexgrid.width * (_CORNER_OFFSETS[:, 0] + xs[:, None])
+    corners[..., 1] = hexgrid.height * (_CORNER_OFFSETS[:, 1] + 3 * ys[:, None])
+
+    return corners
+
+
+def tree_dots(hexgrid, hexagons):
+    """Helper function to calculate the centers of the hexagons as a
+    polygon of points to draw at once.
+    """
+    width, height = hexgrid
+    coords = np.array([(h.x, h.y) for h in hexagons]).reshape(-1, 2)
+    centers = coords * (width, 3 * height)
+
+    return QtGui.QPolygon(centers.ravel().tolist())
@@ -1,5 +1,3 @@
-from csv import writer
-import re
 import os
 
 import hexutil
@@ -23,6 +21,7 @@ class Model(QtWidgets.QMainWindow):
     |scene: QGraphicsScene
     |view: QGraphicsView
     |grid: Grid
+    |proxy: QGraphicsProxyWidget
     |menu_bar: QMenuBar
     |run_list: QListWidget
     |load_from_file_button: QPushButton
@@ -68,25 +67,41 @@ class Model(QtWidgets.QMainWindow):
         self.scene = QtWidgets.QGraphicsScene(self)
         self.view = QtWidgets.QGraphicsView(self.scene)
 
+        # The grid antialiases its own drawing, the view does not have to
+        # smooth or save any state around it.
+        self.view.setRenderHint(QtGui.QPainter.Antialiasing, False)
+        self.view.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, False)
+        self.view.setViewportUpdateMode(QtWidgets.QGraphicsView.SmartViewportUpdate)
+        self.view.setOptimizationFlags(
+            QtWidgets.QGraphicsView.DontSavePainterState
+            | QtWidgets.QGraphicsView.DontAdjustForAntialiasing)
+
         # Creates the grid that visualises all the hexagons by painting.
         self.grid = Grid()
 
-        self.scene.addWidget(self.grid)
+        self.proxy = self.scene.addWidget(self.grid)
+
+        # Caches the painted grid so scrolling only paints the newly
+        # exposed parts.
+        self.proxy.setCacheMode(QtWidgets.QGraphicsItem.DeviceCoordinateCache)
         self.setCentralWidget(self.view)
 
         # Connects scroll movements to update visible window of grid.
+        self._setting_scroll_area = False
         self.view.verticalScrollBar().valueChanged.connect(self.window_change)
         self.view.horizontalScrollBar().valueChanged.connect(self.window_change)
 
         # Connects a keybind to the zoom in method.
-        self.zoom_in_shortcut = QtWidgets.QShortcut(
-            QtGui.QKeySequence('Ctrl++'), self)
-        self.zoom_in_shortcut.activated.connect(self.zoom_in)
+        self.zoom_in_action = QtWidgets.QAction(self)
+        self.zoom_in_action.setShortcut(QtGui.QKeySequence('Ctrl++'))
+        self.zoom_in_action.triggered.connect(self.zoom_in)
+        self.addAction(self.zoom_in_action)
 
         # Connects a keybind to the zoom out method.
-        self.zoom_out_shortcut = QtWidgets.QShortcut(
-            QtGui.QKeySequence('Ctrl+-'), self)
-        self.zoom_out_shortcut.activated.connect(self.zoom_out)
+        self.zoom_out_action = QtWidgets.QAction(self)
+        self.zoom_out_action.setShortcut(QtGui.QKeySequence('Ctrl+-'))
+        self.zoom_out_action.triggered.connect(self.zoom_out)
+        self.addAction(self.zoom_out_action)
 
         # Creates a menu top left.
         menu_bar = self.menuBar()
@@ -115,6 +130,8 @@ class Model(QtWidgets.QMainWindow):
         # Creates a list that shows all runs in the current session.
         run_list_box = QtWidgets.QVBoxLayout()
         self.run_list = QtWidgets.QListWidget()
+        # Items of the list by the id of their run.
+        self._run_items = {}
         self.run_list.setMaximumHeight(300)
         self.run_list.itemClicked.connect(self.grid.load_run)
         self.grid.run_list_update.connect(self.update_run_list)
@@ -185,40 +202,28 @@ class Model(QtWidgets.QMainWindow):
         """Activates the loading of the ribbons of the selected file."""
         file_name = action.text()
         self.dock_widget.setWindowTitle(f"{file_name}")
-        self.grid.map.load_ribbons(f"data/tree_locations/{file_name}.csv")
-        self.grid.repaint()
+        self.grid.load_ribbons(f"data/tree_locations/{file_name}.csv")
 
     def load_run_from_file(self):
         """Loads a run or multiple runs from a file or multiple csv files."""
         files, _ = QtWidgets.QFileDialog.getOpenFileNames(self,
             "Load Run(s) from File(s)", "data/runs","CSV Files (*.csv)")
 
-        for file in files:
-            with open(file, 'r') as file:
-                next(file)
-                hexagons = []
-                for line in file:
-                    # Stops when the footer has been reached.
-                    if not line[0].isnumeric():
-                        break
-
-                    # Retrieves the hex coords from the file.
-                    values = line.split(",")
-                    hex_x = int(values[0])
-                    hex_y = int(values[1])
+        # Updates the run list only once after all runs have been added.
+        self.run_list.setUpdatesEnabled(False)
+        try:
+            for file in files:
+                file_name, hexagons = read_run_file(file, self.grid.map)
 
-                    hex = self.grid.map.tiles[(hex_x, hex_y)]
-                    hexagons.append(hex)
-
-                # Retrieves file name without path and extensions.
-                file_name = Path(file.name).stem
-
-                self.grid.create_run(file_name, hexagons)
+                # Skips empty files.
+                if hexagons:
+                    self.grid.create_run(file_name, hexagons)
+        finally:
+            self.run_list.setUpdatesEnabled(True)
 
     def save_run_to_file(self):
         """Saves the selected run to a csv file."""
-        selected_run = self.run_list.selectedItems()[0].text()
-        selected_run_id = int(selected_run.partition(":")[0])
+        selected_run_id = self.run_list.selectedItems()[0].data(QtCore.Qt.UserRole)
         run_to_be_saved = self.grid.runs[selected_run_id]
         optimal_run = self.grid.optimal_runs[selected_run_id]
 
@@ -231,95 +236,77 @@ class Model(QtWidgets.QMainWindow):
             return False
 
         # Removes .csv from the end of file name if necessary.
-        file_name = re.sub(r".csv$", "", file_name)
-
-        with open(f"{file_name}.csv", "w", newline='') as file:
-            csv_writer = writer(file)
-
+        if file_name.endswith(".csv"):
+            file_name = file_name[:-4]
+
+        update_fov = self.grid.update_fov
+        run_hexagons = list(run_to_be_saved.get_hexagons())
+        optimal_hexagons = list(optimal_run.get_hexagons())
+        run_length = len(run_hexagons)
+        optimal_length = len(optimal_hexagons)
+
+        # Finds the hexagons where each ribbon is collected for the first time.
+        collected = first_occurrences(run_hexagons, self.grid.map.get_tree_number)
+        optimal_collected = first_occurrences(optimal_hexagons,
+                                              self.grid.map.get_tree_number)
+
+        # Calculates the gps coordinates of the hexagons of both runs at once.
+        lats, longs = self.grid.map.get_gps_coords_batch(
+            [h.x for h in run_hexagons], [h.y for h in run_hexagons])
+        lats, longs = lats.tolist(), longs.tolist()
+        optimal_lats, optimal_longs = self.grid.map.get_gps_coords_batch(
+            [h.x for h in optimal_hexagons], [h.y for h in optimal_hexagons])
+        optimal_lats, optimal_longs = optimal_lats.tolist(), optimal_longs.tolist()
+
+        # The rows are formatted as csv lines and written as bytes at once,
+        # none of the values contain characters that have to be quoted.
+        with open(f"{file_name}.csv", "wb", buffering=1 << 20) as file:
             # Writes the header.
-            csv_writer.writerow(["x", "y",
-                                 "lat", "long",
-                                 "ribbon seen", "ribbon collected",
-                                 "x", "y",
-                                 "lat", "long",
-                                 "ribbon seen", "ribbon collected"])
-
-            visited_trees = []
-            seen_trees = []
-            optimal_visited_trees = []
-            optimal_seen_trees = []
-            for idx, hex in enumerate(run_to_be_saved.get_hexagons()):
-                # Values of the run.
-                hex_gps_coords = self.grid.map.get_gps_coords(hex)
-                hex_x = hex.x
-                hex_y = hex.y
-                hex_lat = hex_gps_coords[0]
-                hex_long = hex_gps_coords[1]
-                ribbon_seen = ""
-                ribbon_collected = ""
-
-                # Onlydds tree number if not seen before.
-                visible_trees = self.grid.update_fov(hex)
-                for tree in visible_trees:
-                    if tree not in seen_trees:
-                        ribbon_seen += f"{tree} "
-                        seen_trees.append(tree)
-
-                # Only writes tree number if ribbon has not been collected before.
-                tree_number = self.grid.map.get_tree_number(hex)
-                if tree_number:
-                    if tree_number not in visited_trees:
-                        ribbon_collected = tree_number
-                        visited_trees.append(tree_number)
-
-                if idx < len(optimal_run.get_hexagons()):
-                    # Values of the optimal run.
-                    optimal_hex = optimal_run.get_hexagons()[idx]
-                    optimal_hex_gps_coords = self.grid.map.get_gps_coords(optimal_hex)
-                    optimal_hex_x = optimal_hex.x
-                    optimal_hex_y = optimal_hex.y
-                    optimal_hex_lat = optimal_hex_gps_coords[0]
-                    optimal_hex_long = optimal_hex_gps_coords[1]
-                    optimal_ribbon_seen = ""
-                    optimal_ribbon_collected = ""
-
-                    # Adds tree number if not seen before.
-                    visible_trees = self.grid.update_fov(optimal_hex)
-                    for tree in visible_trees:
-                        if tree not in optimal_seen_trees:
-                            optimal_ribbon_seen += f"{tree} "
-                            optimal_seen_trees.append(tree)
-
-                    # Only writes tree number if ribbon has not been collected before.
-                    tree_number = self.grid.map.get_tree_number(optimal_hex)
-                    if tree_number:
-                        if tree_number not in optimal_visited_trees:
-                            optimal_ribbon_collected = tree_number
-                            optimal_visited_trees.append(tree_number)
-
-                    # Prints progress.
-                    print(f"{idx/len(run_to_be_saved.get_hexagons()) * 100}%")
-
-                else:
-                    optimal_hex_x = ""
-                    optimal_hex_y = ""
-                    optimal_hex_lat = ""
-                    optimal_hex_long = ""
-                    optimal_ribbon_seen = ""
-                    optimal_ribbon_collected = ""
-
-                csv_writer.writerow([hex_x, hex_y,
-                                     hex_lat, hex_long,
-                                     ribbon_seen, ribbon_collected,
-                                     optimal_hex_x, optimal_hex_y,
-                                     optimal_hex_lat, optimal_hex_long,
-                                     optimal_ribbon_seen, optimal_ribbon_collected])
+            file.write(b"x,y,lat,long,ribbon seen,ribbon collected,"
+                       b"x,y,lat,long,ribbon seen,ribbon collected\r\n")
+
+            seen_trees = set()
+            optimal_seen_trees = set()
+            rows = []
+
+            # Writes the rows that have a hexagon of both runs.
+            common_length = min(run_length, optimal_length)
+            for idx in range(common_length):
+                hex = run_hexagons[idx]
+                optimal_hex = optimal_hexagons[idx]
+
+                # Only adds tree numbers if not seen before.
+                ribbon_seen = newly_seen(update_fov(hex), seen_trees)
+                optimal_ribbon_seen = newly_seen(update_fov(optimal_hex),
+                                                 optimal_seen_trees)
+
+                # Prints progress.
+                print(f"{idx/run_length * 100}%")
+
+                rows.append(f"{hex.x},{hex.y},"
+                            f"{lats[idx]},{longs[idx]},"
+                            f"{ribbon_seen},{collected.get(idx, '')},"
+                            f"{optimal_hex.x},{optimal_hex.y},"
+                            f"{optimal_lats[idx]},{optimal_longs[idx]},"
+                            f"{optimal_ribbon_seen},{optimal_collected.get(idx, '')}\r\n")
+
+            # Writes the rest of the run with empty values for the optimal run.
+            for idx in range(common_length, run_length):
+                hex = run_hexagons[idx]
+                ribbon_seen = newly_seen(update_fov(hex), seen_trees)
+
+                rows.append(f"{hex.x},{hex.y},"
+                            f"{lats[idx]},{longs[idx]},"
+                            f"{ribbon_seen},{collected.get(idx, '')},"
+                            f",,,,,\r\n")
 
             # Adds a footer with the total length of the run.
-            csv_writer.writerow(
-                ["length", (len(run_to_be_saved.get_hexagons()) - 1) * self.grid.map.hex_width,
-                "", "", "", "",
-                "optimal length", (len(optimal_run.get_hexagons()) - 1) * self.grid.map.hex_width])
+            rows.append(f"length,{(run_length - 1) * self.grid.map.hex_width},"
+                        f",,,,"
+                        f"optimal length,{(optimal_length - 1) * self.grid.map.hex_width}\r\n")
+
+            # Writes all the rows at once.
+            file.write("".join(rows).encode())
 
             print("DONE")
 
@@ -329,18 +316,20 @@ class Model(QtWidgets.QMainWindow):
     def update_run_list(self, run):
         """Updates the list with runs by removing, updating or adding runs."""
         # Checks if the run is already in the list.
-        matched_run = self.run_list.findItems(f"{abs(run.run_id)}",
-            QtCore.Qt.MatchStartsWith)
+        matched_run = self._run_items.get(abs(run.run_id))
 
         # Removes, updates or adds the run entry.
         if run.run_id < 0 and matched_run:
-            idx = self.run_list.indexFromItem(matched_run[0])
-            self.run_list.takeItem(idx.row())
+            del self._run_items[-run.run_id]
+            self.run_list.takeItem(self.run_list.row(matched_run))
         elif matched_run:
-            matched_run[0].setText(f"{run.run_id}: {run.name}, {len(run.hexagons) - 1} m")
+            matched_run.setText(f"{run.run_id}: {run.name}, {len(run.hexagons) - 1} m")
         elif run.run_id > 0:
             list_name = f"{run.run_id}: {run.name}, {len(run.hexagons) - 1} m"
-            self.run_list.addItem(list_name)
+            item = QtWidgets.QListWidgetItem(list_name)
+            item.setData(QtCore.Qt.UserRole, run.run_id)
+            self.run_list.addItem(item)
+            self._run_items[run.run_id] = item
 
     @QtCore.pyqtSlot(bool)
     def update_run_buttons(self, run_creation):
@@ -388,6 +377,7 @@ class Model(QtWidgets.QMainWindow):
                 self.grid.toggle_fov = False
             else:
                 self.grid.toggle_fov = True
+            self.grid.update_hexagons(self.grid.fov)
 
     def resizeEvent(self, event):
         """Instructs to update dimensions when window is resized."""
@@ -397,6 +387,9 @@ class Model(QtWidgets.QMainWindow):
 
     def window_change(self):
         """Changes the visible window's dimensions."""
+        if self._setting_scroll_area:
+            return
+
         min_hor = self.view.horizontalScrollBar().value()
         min_ver = self.view.verticalScrollBar().value()
 
@@ -418,6 +411,7 @@ class Model(QtWidgets.QMainWindow):
             return False
 
         self.grid.update_size()
+        self.proxy.update()
         self.set_scroll_area()
         self.set_view_to_center(center_hex)
 
@@ -430,18 +424,93 @@ class Model(QtWidgets.QMainWindow):
             return False
 
         self.grid.update_size()
+        self.proxy.update()
         self.set_scroll_area()
         self.set_view_to_center(center_hex)
 
     def set_scroll_area(self):
         """Sets the maximum scrollable area of the view."""
         max_size = self.grid.maximum_size
-        self.view.horizontalScrollBar().setMaximum(
-            max_size[0] - self.view.rect().width())
-        self.view.verticalScrollBar().setMaximum(
-            max_size[1] - self.view.rect().height())
+
+        # Changes the window only once after both maxima have been set.
+        self._setting_scroll_area = True
+        try:
+            self.view.horizontalScrollBar().setMaximum(
+                max_size[0] - self.view.rect().width())
+            self.view.verticalScrollBar().setMaximum(
+                max_size[1] - self.view.rect().height())
+        finally:
+            self._setting_scroll_area = False
+        self.window_change()
 
     def set_view_to_center(self, hexagon):
         """Sets the center of the view to the given hexagon."""
         center = self.grid.hexgrid.center(hexagon)
         self.view.centerOn(center[0], center[1])
+
+
+def first_occurrences(hexagons, get_tree_number):
+    """Helper function to find where each ribbon is collected for the
+    first time in a sequence of hexagons.
+
+    Returns a dict from the index of the hexagon to its tree number.
+    """
+    visited_trees = set()
+    occurrences = {}
+    for idx, hexagon in enumerate(hexagons):
+        tree_number = get_tree_number(hexagon)
+        if tree_number and tree_number not in visited_trees:
+            visited_trees.add(tree_number)
+            occurrences[idx] = tree_number
+
+    return occurrences
+
+
+def read_run_file(file, grid_map):
+    """Helper function to read the hexagons of a run from a csv file.
+
+    Returns the file name without path and extension and the hexagons,
+    which are empty if the file has no rows. Rows with a hexagon that is
+    not on the map are skipped.
+    """
+    # Binds the map bounds and lookups to locals before the loop.
+    width = grid_map.num_hor * 2
+    height = grid_map.num_ver
+    hexagons = []
+    append = hexagons.append
+    Hex = hexutil.Hex
+    with open(file, 'r') as f:
+        next(f, None)
+        for line in f:
+            # Stops when the footer has been reached.
+            if not line.lstrip("-")[:1].isdigit():
+                break
+
+            # Retrieves the hex coords from the file.
+            values = line.split(",", 2)
+            hex_x = int(values[0])
+            hex_y = int(values[1])
+
+            # Skips hexagons outside of the map or with invalid coordinates.
+            if not (0 <= hex_x < width and 0 <= hex_y < height
+                    and (hex_x + hex_y) % 2 == 0):
+                continue
+
+            append(Hex(hex_x, hex_y))
+
+    return Path(file).stem, hexagons
+
+
+def newly_seen(visible_trees, seen_trees):
+    """Helper function to add the visible trees to the seen trees.
+
+    Returns the tree numbers that were not seen before, each followed
+    by a space.
+    """
+    ribbon_seen = ""
+    for tree in visible_trees:
+        if tree not in seen_trees:
+            ribbon_seen += f"{tree} "
+            seen_trees.add(tree)
+
+    return ribbon_seen